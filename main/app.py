@@ -14,7 +14,10 @@ import time
 import os
 
 # Import our models
-from models import db, User, ChatSession, Message, SystemSettings, UserRole, init_db
+from models import db, User, ChatSession, Message, SystemSettings, UserRole, init_db, save_chat_turn
+from caching import init_caching, conditional_json
+from embeddings import init_embeddings, get_embedding
+from persistence import GroupCommitWriter
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this in production!
@@ -31,6 +34,15 @@ login_manager.login_view = 'login'
 # Initialize database
 init_db(app)
 
+# Initialize HTTP caching (compression and fingerprinted static URLs)
+init_caching(app)
+
+# Initialize semantic search (embedding index and backfill queue)
+embedding_index, embedding_queue = init_embeddings(app)
+
+# Chat turns are written by a background writer that group-commits concurrent requests
+chat_writer = GroupCommitWriter(app)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -192,45 +204,28 @@ def chat():
     if not user_input:
         return jsonify({"error": "No message provided"}), 400
     
-    # Get or create chat session
+    # Look up the chat session; new sessions are created when the turn is saved
+    chat_session = None
     if session_id:
         chat_session = ChatSession.query.filter_by(
             id=session_id, 
             user_id=current_user.id
         ).first()
-    else:
-        # Create new session
-        chat_session = ChatSession(
-            user_id=current_user.id,
-            model_used=model
-        )
-        db.session.add(chat_session)
-        db.session.commit()
-    
-    if not chat_session:
-        return jsonify({"error": "Invalid session"}), 400
-    
-    # Check message limit
-    max_messages = int(get_setting('max_messages_per_session', '100'))
-    if len(chat_session.messages) >= max_messages:
-        return jsonify({"error": f"Session limit reached ({max_messages} messages)"}), 400
-    
-    # Save user message
-    user_message = Message(
-        session_id=chat_session.id,
-        content=user_input,
-        role='user'
-    )
-    db.session.add(user_message)
-    db.session.commit()
-    
-    # Update session title if this is the first message or title is still default
-    if not chat_session.title or chat_session.title == "New Chat":
-        chat_session.update_title()
-        db.session.commit()
+        
+        if not chat_session:
+            return jsonify({"error": "Invalid session"}), 400
+        
+        # Check message limit
+        max_messages = int(get_setting('max_messages_per_session', '100'))
+        if chat_session.get_message_count() >= max_messages:
+            return jsonify({"error": f"Session limit reached ({max_messages} messages)"}), 400
     
     # Get AI response
+    asked_at = datetime.utcnow()
     start_time = time.time()
+    reply = None
+    response_time = None
+    error = None
     try:
         payload = {
             "model": model,
@@ -249,24 +244,39 @@ def chat():
         
         response_time = time.time() - start_time
         
-        # Save AI response
-        ai_message = Message(
-            session_id=chat_session.id,
-            content=reply,
-            role='assistant',
+    except Exception as e:
+        reply = None
+        error = e
+    
+    # Save the whole turn in one transaction; the user's message is kept even without a reply
+    try:
+        saved = chat_writer.write(
+            save_chat_turn,
+            user_id=current_user.id,
+            session_id=chat_session.id if chat_session else None,
+            model=model,
+            prompt=user_input,
+            asked_at=asked_at,
+            reply=reply,
             response_time=response_time
         )
-        db.session.add(ai_message)
-        db.session.commit()
-        
-        return jsonify({
-            "response": reply,
-            "session_id": chat_session.id,
-            "response_time": response_time
-        })
-        
+    except TimeoutError as e:
+        # The turn was cancelled before it was written, so the client can safely resend
+        return jsonify({"error": f"Error saving messages: {str(e)}"}), 503
     except Exception as e:
-        return jsonify({"error": f"Error contacting Ollama: {str(e)}"}), 500
+        return jsonify({"error": f"Error saving messages: {type(e).__name__}: {str(e)}"}), 500
+    
+    # Embed the turn in the background for semantic search
+    embedding_queue.enqueue(*[message_id for message_id in (saved['user_message_id'], saved['assistant_message_id']) if message_id])
+    
+    if error:
+        return jsonify({"error": f"Error contacting Ollama: {str(error)}"}), 500
+    
+    return jsonify({
+        "response": reply,
+        "session_id": saved['session_id'],
+        "response_time": response_time
+    })
 
 @app.route('/sessions')
 @login_required
@@ -290,8 +300,12 @@ def view_session(session_id):
 @login_required
 def api_sessions():
     """API endpoint for user sessions"""
-    sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.updated_at.desc()).all()
-    return jsonify([session.to_dict() for session in sessions])
+    def build():
+        sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.updated_at.desc()).all()
+        return [session.to_dict() for session in sessions]
+    
+    etag, last_modified = ChatSession.get_user_cache_validators(current_user.id)
+    return conditional_json(etag, last_modified, build)
 
 @app.route('/api/session/<int:session_id>/messages')
 @login_required
@@ -301,12 +315,61 @@ def api_session_messages(session_id):
     if not session:
         return jsonify({"error": "Session not found"}), 404
     
-    messages = Message.query.filter_by(session_id=session_id).order_by(Message.created_at).all()
+    def build():
+        messages = Message.query.filter_by(session_id=session_id).order_by(Message.created_at).all()
+        return {
+            "success": True,
+            "messages": [message.to_dict() for message in messages]
+        }
+    
+    etag, last_modified = session.get_cache_validators()
+    return conditional_json(etag, last_modified, build)
+
+@app.route('/api/session/<int:session_id>/related')
+@login_required
+def api_related_sessions(session_id):
+    """API endpoint for conversations similar to a session"""
+    session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+    if not session:
+        return jsonify({"error": "Session not found"}), 404
+    
+    k = min(request.args.get('k', 5, type=int), 50)
+    related = embedding_index.related_sessions(session_id, k=k, user_id=current_user.id)
+    sessions = {s.id: s for s in ChatSession.query.filter(ChatSession.id.in_([sid for sid, _ in related])).all()}
+    
     return jsonify({
         "success": True,
-        "messages": [message.to_dict() for message in messages]
+        "sessions": [dict(sessions[sid].to_dict(), score=score) for sid, score in related if sid in sessions]
     })
 
+@app.route('/api/search/semantic')
+@login_required
+def api_semantic_search():
+    """API endpoint for earlier messages relevant to a prompt"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    
+    model = get_setting('embedding_model', 'nomic-embed-text')
+    if embedding_index.model != model:
+        return jsonify({"error": "Embedding index is being rebuilt"}), 503
+    
+    vector = get_embedding(query, model)
+    if vector is None:
+        return jsonify({"error": "Embedding model unavailable"}), 503
+    
+    k = min(request.args.get('k', 10, type=int), 50)
+    matches = embedding_index.search(vector, k=k, user_id=current_user.id)
+    messages = {m.id: m for m in Message.query.filter(Message.id.in_([mid for mid, _, _ in matches])).all()}
+    
+    results = []
+    for message_id, session_id, score in matches:
+        message = messages.get(message_id)
+        if message:
+            results.append(dict(message.to_dict(), session_id=session_id, session_title=message.session.title, score=score))
+    
+    return jsonify({"success": True, "results": results})
+
 @app.route('/api/models')
 @login_required
 def api_models():
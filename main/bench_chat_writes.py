@@ -0,0 +1,211 @@
+"""
+chatbot/main/bench_chat_writes.py
+
+Load test for chat turn persistence: group commit vs. one commit per write.
+
+Usage: python3 bench_chat_writes.py [--threads 32] [--turns 50] [--crash]
+
+Each thread saves turns the way /chat does and records every turn it was
+told was committed. Afterwards the database is reopened with a fresh
+connection and every acknowledged message is checked to be on disk.
+
+With --crash, the group-commit writer runs in a subprocess that reports each
+acknowledged turn on stdout and is killed with SIGKILL partway through the
+load. Every turn it acknowledged before dying must be in the database. This
+covers process crashes; surviving power loss additionally relies on SQLite's
+default synchronous=FULL, which fsyncs on every commit.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from flask import Flask
+
+from models import db, User, ChatSession, Message, init_db, save_chat_turn
+from persistence import GroupCommitWriter
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    return app
+
+def save_turn_per_commit(app, user_id, session_id, prompt, reply):
+    """The old /chat write path: a separate commit for every step"""
+    with app.app_context():
+        if session_id:
+            chat_session = db.session.get(ChatSession, session_id)
+        else:
+            chat_session = ChatSession(user_id=user_id, model_used='bench')
+            db.session.add(chat_session)
+            db.session.commit()
+        user_message = Message(session_id=chat_session.id, content=prompt, role='user')
+        db.session.add(user_message)
+        db.session.commit()
+        if not chat_session.title or chat_session.title == "New Chat":
+            chat_session.update_title()
+            db.session.commit()
+        ai_message = Message(session_id=chat_session.id, content=reply, role='assistant')
+        db.session.add(ai_message)
+        db.session.commit()
+        result = {
+            'session_id': chat_session.id,
+            'user_message_id': user_message.id,
+            'assistant_message_id': ai_message.id
+        }
+        db.session.remove()
+        return result
+
+def run(label, save_turn, threads, turns):
+    acknowledged = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        session_id = None
+        for turn in range(turns):
+            try:
+                saved = save_turn(session_id, f"question {turn} from client {number}", f"answer {turn}")
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            session_id = saved['session_id']
+            with lock:
+                acknowledged.append(saved)
+
+    workers = [threading.Thread(target=client, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {len(acknowledged)} turns in {elapsed:.2f}s "
+          f"({len(acknowledged) / elapsed:,.0f} turns/s, {len(errors)} errors)")
+    return acknowledged
+
+def verify(path, acknowledged):
+    """Check every acknowledged message with a connection that shares nothing with the app"""
+    connection = sqlite3.connect(path)
+    stored = {row[0] for row in connection.execute("SELECT id FROM messages")}
+    connection.close()
+    expected = {saved[key] for saved in acknowledged for key in ('user_message_id', 'assistant_message_id')}
+    missing = expected - stored
+    print(f"  durability: {len(expected) - len(missing)}/{len(expected)} acknowledged messages on disk")
+    return not missing
+
+def child(args):
+    """Write turns forever from many threads, printing each one once it is acknowledged"""
+    app = create_app(args.child)
+    with app.app_context():
+        user_id = User.query.first().id
+    writer = GroupCommitWriter(app, window=args.window)
+    print_lock = threading.Lock()
+
+    def client(number):
+        session_id = None
+        turn = 0
+        while True:
+            saved = writer.write(save_chat_turn, user_id=user_id, session_id=session_id, model='bench',
+                                 prompt=f"question {turn} from client {number}", asked_at=datetime.utcnow(),
+                                 reply=f"answer {turn}")
+            session_id = saved['session_id']
+            turn += 1
+            with print_lock:
+                print(json.dumps(saved), flush=True)
+
+    for number in range(args.threads):
+        threading.Thread(target=client, args=(number,), daemon=True).start()
+    threading.Event().wait()
+
+def crash_test(args, directory):
+    """Kill a writer process under load and check every turn it acknowledged"""
+    path = os.path.join(directory, 'crash.db')
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', path,
+         '--threads', str(args.threads), '--window', str(args.window)],
+        stdout=subprocess.PIPE, text=True
+    )
+
+    acknowledged = []
+    for line in process.stdout:
+        try:
+            saved = json.loads(line)
+        except ValueError:
+            continue  # startup output, or a line cut short by the kill
+        if isinstance(saved, dict):
+            acknowledged.append(saved)
+        if len(acknowledged) == args.kill_after:
+            process.kill()
+    process.wait()
+
+    connection = sqlite3.connect(path)
+    stored = connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    connection.close()
+    print(f"crash: writer killed after {len(acknowledged)} acknowledged turns, {stored} messages on disk")
+    return verify(path, acknowledged)
+
+def compare(args, directory):
+    """Run the same load through per-write commits and through group commit"""
+    ok = True
+    path = os.path.join(directory, 'per_commit.db')
+    app = create_app(path)
+    with app.app_context():
+        user_id = User.query.first().id
+    acknowledged = run('per-write commits', lambda session_id, prompt, reply:
+                       save_turn_per_commit(app, user_id, session_id, prompt, reply),
+                       args.threads, args.turns)
+    ok &= verify(path, acknowledged)
+
+    path = os.path.join(directory, 'group_commit.db')
+    app = create_app(path)
+    with app.app_context():
+        user_id = User.query.first().id
+    writer = GroupCommitWriter(app, window=args.window)
+    acknowledged = run('group commit', lambda session_id, prompt, reply:
+                       writer.write(save_chat_turn, user_id=user_id, session_id=session_id, model='bench',
+                                    prompt=prompt, asked_at=datetime.utcnow(), reply=reply),
+                       args.threads, args.turns)
+    print(f"  {writer.commits} commits for {len(acknowledged)} turns")
+    ok &= verify(path, acknowledged)
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--window', type=float, default=0.005)
+    parser.add_argument('--crash', action='store_true', help='kill a writer process mid-run and check durability')
+    parser.add_argument('--kill-after', type=int, default=500, help='acknowledged turns before the kill')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        if args.crash:
+            ok = crash_test(args, directory)
+        else:
+            ok = compare(args, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    if not ok:
+        raise SystemExit("Acknowledged messages are missing from the database")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+chatbot/main/bench_embeddings.py
+
+Benchmark for the embedding index: incremental appends and top-k queries.
+
+Usage: python3 bench_embeddings.py [--vectors 1000000] [--dim 768] [--queries 50]
+
+At the defaults the index files take about 3 GB, so point --dir at a disk
+with room to spare.
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from embeddings import EmbeddingIndex
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--vectors', type=int, default=1_000_000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--batch', type=int, default=10_000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--dir', default=None)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    rng = np.random.default_rng(0)
+    try:
+        index = EmbeddingIndex(directory)
+
+        start = time.perf_counter()
+        for offset in range(0, args.vectors, args.batch):
+            count = min(args.batch, args.vectors - offset)
+            message_ids = np.arange(offset, offset + count)
+            ids = np.column_stack([message_ids, message_ids // 10, message_ids % args.users])
+            index.add_many(ids, rng.standard_normal((count, args.dim), dtype=np.float32))
+        elapsed = time.perf_counter() - start
+        print(f"append: {args.vectors} x {args.dim} in {elapsed:.2f}s ({args.vectors / elapsed:,.0f} vectors/s)")
+
+        # First query maps the files and pulls pages in; measure it separately
+        queries = rng.standard_normal((args.queries + 1, args.dim), dtype=np.float32)
+        start = time.perf_counter()
+        index.search(queries[0], k=args.k)
+        print(f"cold query: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        for label, kwargs in (('query', {}), ('query (one user)', {'user_id': 1})):
+            timings = []
+            for query in queries[1:]:
+                start = time.perf_counter()
+                index.search(query, k=args.k, **kwargs)
+                timings.append(time.perf_counter() - start)
+            timings = np.array(timings) * 1000
+            print(f"{label}: p50 {np.percentile(timings, 50):.1f}ms, p95 {np.percentile(timings, 95):.1f}ms")
+
+        start = time.perf_counter()
+        index.related_sessions(0, k=args.k)
+        print(f"related sessions: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        start = time.perf_counter()
+        index.add(args.vectors, args.vectors // 10, 0, rng.standard_normal(args.dim, dtype=np.float32))
+        index.search(queries[0], k=args.k)
+        print(f"append one + query: {(time.perf_counter() - start) * 1000:.1f}ms")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
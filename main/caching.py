@@ -0,0 +1,178 @@
+"""
+chatbot/main/caching.py
+
+HTTP caching for the Llama Chat application: conditional JSON responses,
+gzip/brotli compression and content-hashed static asset URLs.
+"""
+
+from flask import request, jsonify, current_app
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+import gzip
+import hashlib
+import os
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Fingerprinted static URLs never change content, so they can be cached for a year
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 500
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+}
+
+# (path, mtime) -> content hash
+_fingerprints = {}
+
+# (filename, fingerprint, encoding) -> compressed bytes
+_compressed_static = {}
+
+def static_fingerprint(filename):
+    """Get a short content hash for a file in the static folder, or None if it does not exist"""
+    path = safe_join(current_app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        return None
+
+    key = (path, os.path.getmtime(path))
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+        _fingerprints[key] = fingerprint
+    return fingerprint
+
+def conditional_json(etag, last_modified, build):
+    """Return a JSON response, or an empty 304 if the client already has this version.
+
+    `build` is only called when the client's copy is stale, so unchanged polls
+    skip serialization entirely.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = jsonify(build())
+    else:
+        response = current_app.response_class(status=304)
+
+    # Weak validators: the body may be re-encoded (compressed) on the way out
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # Per-user data: browsers may keep it but must revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def choose_encoding():
+    """Pick the best content encoding the client accepts"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress(data, encoding, best=False):
+    """Compress bytes; `best` trades CPU for size and is meant for cached output"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6)
+
+def cache_static_response(response):
+    """Mark fingerprinted static responses as immutable"""
+    filename = request.view_args.get('filename')
+    version = request.args.get('v')
+    if not version or version != static_fingerprint(filename):
+        return response
+
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    response.cache_control.immutable = True
+    response.expires = int(time.time() + STATIC_MAX_AGE)
+    return response
+
+def compressed_static_file(response, filename, encoding):
+    """Get the compressed bytes of a static file, reading it only on a cache miss.
+
+    Returns None if the file is too small to be worth compressing.
+    """
+    path = safe_join(current_app.static_folder, filename)
+    if os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return None
+
+    key = (filename, static_fingerprint(filename), encoding)
+    compressed = _compressed_static.get(key)
+    if compressed is None:
+        # Static files are sent as file wrappers; read them into memory to compress
+        response.direct_passthrough = False
+        compressed = compress(response.get_data(), encoding, best=True)
+        _compressed_static[key] = compressed
+    else:
+        # The cached body replaces the file, so release it without reading
+        if hasattr(response.response, 'close'):
+            response.response.close()
+        response.direct_passthrough = False
+    return compressed
+
+def compress_response(response):
+    """Compress eligible responses with gzip or brotli"""
+    if (response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or 'Content-Range' in response.headers
+            # Only static files are read into memory; other streams and files pass through
+            or (response.is_streamed and request.endpoint != 'static')):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if request.endpoint == 'static':
+        compressed = compressed_static_file(response, request.view_args.get('filename'), encoding)
+        if compressed is None:
+            return response
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        compressed = compress(data, encoding)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Byte ranges would refer to the uncompressed file
+    response.headers.pop('Accept-Ranges', None)
+
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_caching(app):
+    """Register static fingerprinting and response compression with the Flask app"""
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    @app.after_request
+    def apply_http_caching(response):
+        if request.endpoint == 'static':
+            response = cache_static_response(response)
+        return compress_response(response)
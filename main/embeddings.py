@@ -0,0 +1,328 @@
+"""
+chatbot/main/embeddings.py
+
+Local embedding index for semantic search and related-conversation lookup.
+
+Message embeddings come from Ollama's /api/embeddings and are kept in
+append-only files in the instance folder:
+
+  embeddings.f32   -- float32 vectors, one L2-normalized row per message
+  embeddings.ids   -- int64 rows of (message_id, session_id, user_id)
+  embeddings.json  -- embedding model name and vector dimension
+
+Both are memory-mapped for queries, so similarity is one vectorized dot
+product over the whole file. The database stays the source of truth: the
+index can be deleted at any time and is rebuilt by the backfill queue.
+"""
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import requests
+
+from models import db, ChatSession, Message, SystemSettings
+
+OLLAMA_EMBEDDINGS_URL = "http://localhost:11434/api/embeddings"
+
+# Seconds to wait for Ollama before treating it as unavailable
+EMBEDDING_TIMEOUT = 30
+
+# Number of int64 columns per row in the ids file
+ID_COLUMNS = 3
+
+def get_embedding(text, model):
+    """Get an embedding vector for text from Ollama, or None if it is unavailable"""
+    try:
+        response = requests.post(OLLAMA_EMBEDDINGS_URL, json={"model": model, "prompt": text}, timeout=EMBEDDING_TIMEOUT)
+        response.raise_for_status()
+        embedding = response.json().get("embedding")
+        return np.asarray(embedding, dtype=np.float32) if embedding else None
+    except Exception as e:
+        print(f"Error getting embedding from Ollama: {e}")
+        return None
+
+def normalize(vectors):
+    """L2-normalize vectors row-wise so that dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k(scores, k):
+    """Get the indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+class EmbeddingIndex:
+    """Append-only, memory-mapped float32 vector index keyed by message"""
+
+    def __init__(self, directory, name='embeddings'):
+        self.vectors_path = os.path.join(directory, f'{name}.f32')
+        self.ids_path = os.path.join(directory, f'{name}.ids')
+        self.meta_path = os.path.join(directory, f'{name}.json')
+        self.model = None
+        self.dim = None
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._ids = None
+        self._rows = 0
+        self._message_ids = None
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.model = meta.get('model')
+            self.dim = meta.get('dim')
+        self._truncate()
+
+    def __len__(self):
+        return self._row_count()
+
+    def _row_count(self):
+        """Get the number of complete rows on disk"""
+        # A missing file means no complete rows; _truncate then empties the other one
+        if not self.dim or not os.path.exists(self.vectors_path) or not os.path.exists(self.ids_path):
+            return 0
+        # Vectors are written before ids, so a torn append only leaves a partial tail
+        vector_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        id_rows = os.path.getsize(self.ids_path) // (ID_COLUMNS * 8)
+        return min(vector_rows, id_rows)
+
+    def _truncate(self):
+        """Drop any partial tail left by an interrupted append so later rows stay aligned"""
+        rows = self._row_count()
+        for path, row_size in ((self.vectors_path, (self.dim or 0) * 4), (self.ids_path, ID_COLUMNS * 8)):
+            if os.path.exists(path) and os.path.getsize(path) != rows * row_size:
+                os.truncate(path, rows * row_size)
+
+    def _write_meta(self):
+        with open(self.meta_path, 'w') as f:
+            json.dump({'model': self.model, 'dim': self.dim}, f)
+
+    def reset(self, model=None):
+        """Remove all stored vectors, e.g. when the embedding model changes"""
+        with self._lock:
+            for path in (self.vectors_path, self.ids_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.model = model
+            self.dim = None
+            self._vectors = None
+            self._ids = None
+            self._rows = 0
+            self._message_ids = None
+
+    def add(self, message_id, session_id, user_id, vector):
+        """Append a single message embedding"""
+        self.add_many([(message_id, session_id, user_id)], [vector])
+
+    def add_many(self, ids, vectors):
+        """Append a batch of (message_id, session_id, user_id) rows and their embeddings"""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1, ID_COLUMNS)
+        if not len(ids):
+            return
+        vectors = normalize(vectors).reshape(len(ids), -1)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+            self._truncate()
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.write(ids.tobytes())
+            if self._message_ids is not None:
+                self._message_ids.update(ids[:, 0].tolist())
+
+    def _snapshot(self):
+        """Get (vectors, ids) memory maps covering every complete row"""
+        with self._lock:
+            rows = self._row_count()
+            if rows != self._rows or self._vectors is None:
+                if rows:
+                    self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+                    self._ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(rows, ID_COLUMNS))
+                else:
+                    self._vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+                    self._ids = np.empty((0, ID_COLUMNS), dtype=np.int64)
+                self._rows = rows
+            return self._vectors, self._ids
+
+    def __contains__(self, message_id):
+        if self._message_ids is None:
+            _, ids = self._snapshot()
+            self._message_ids = set(ids[:, 0].tolist())
+        return message_id in self._message_ids
+
+    def search(self, query, k=10, user_id=None, exclude_session_id=None):
+        """Find the k messages most similar to a query vector.
+
+        Returns a list of (message_id, session_id, score), best first.
+        """
+        vectors, ids = self._snapshot()
+        if not len(vectors):
+            return []
+
+        scores = vectors @ normalize(query)
+        mask = None
+        if user_id is not None:
+            mask = ids[:, 2] == user_id
+        if exclude_session_id is not None:
+            other = ids[:, 1] != exclude_session_id
+            mask = other if mask is None else mask & other
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        results = []
+        for row in top_k(scores, k):
+            if np.isneginf(scores[row]):
+                break
+            results.append((int(ids[row, 0]), int(ids[row, 1]), float(scores[row])))
+        return results
+
+    def session_vector(self, session_id):
+        """Get the centroid of a session's message embeddings, or None if none are indexed"""
+        vectors, ids = self._snapshot()
+        rows = np.flatnonzero(ids[:, 1] == session_id)
+        if not len(rows):
+            return None
+        return normalize(vectors[rows].mean(axis=0))
+
+    def related_sessions(self, session_id, k=5, user_id=None):
+        """Find the k sessions whose messages best match a session's centroid.
+
+        Each candidate session is scored by its single closest message.
+        Returns a list of (session_id, score), best first.
+        """
+        centroid = self.session_vector(session_id)
+        if centroid is None:
+            return []
+
+        # Over-fetch messages so a few chatty sessions cannot crowd out the rest
+        matches = self.search(centroid, k=k * 20, user_id=user_id, exclude_session_id=session_id)
+        related = {}
+        for _, match_session_id, score in matches:
+            if match_session_id not in related:
+                related[match_session_id] = score
+                if len(related) == k:
+                    break
+        return list(related.items())
+
+class EmbeddingQueue:
+    """Background queue that embeds new messages and backfills old ones"""
+
+    def __init__(self, app, index, batch_size=32, retry_interval=30):
+        self.app = app
+        self.index = index
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._needs_backfill = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker thread (once) and queue every message not yet indexed"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='embedding-queue', daemon=True)
+            self._thread.start()
+        self._queue.put(None)  # None means "backfill"
+
+    def enqueue(self, *message_ids):
+        """Queue messages for embedding"""
+        for message_id in message_ids:
+            self._queue.put(message_id)
+
+    def _run(self):
+        while True:
+            # Wake up periodically even when idle to retry failed messages
+            # and to notice a change of embedding model
+            try:
+                pending = [self._queue.get(timeout=self.retry_interval)]
+            except queue.Empty:
+                pending = [None] if self._needs_backfill else []
+            while len(pending) < self.batch_size:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self.app.app_context():
+                try:
+                    model, changed = self._sync_model()
+                    # A new model invalidates every stored vector, so rebuild from scratch
+                    if changed or None in pending:
+                        self._backfill()
+                    self._embed([message_id for message_id in pending if message_id is not None], model)
+                except Exception as e:
+                    print(f"Error updating embedding index: {e}")
+                    self._needs_backfill = True
+                finally:
+                    db.session.remove()
+
+    def _sync_model(self):
+        """Get the configured embedding model, resetting the index if it changed"""
+        setting = SystemSettings.query.filter_by(key='embedding_model').first()
+        model = setting.value if setting else 'nomic-embed-text'
+        if self.index.model == model:
+            return model, False
+        self.index.reset(model)
+        return model, True
+
+    def _backfill(self):
+        """Queue every message that is missing from the index"""
+        self._needs_backfill = False
+        missing = [message_id for (message_id,) in db.session.query(Message.id).order_by(Message.id)
+                   if message_id not in self.index]
+        if missing:
+            print(f"Backfilling embeddings for {len(missing)} messages")
+            self.enqueue(*missing)
+
+    def _embed(self, message_ids, model):
+        if not message_ids:
+            return
+
+        rows = db.session.query(Message, ChatSession.user_id).join(
+            ChatSession, Message.session_id == ChatSession.id
+        ).filter(Message.id.in_(message_ids)).all()
+
+        ids, vectors = [], []
+        for message, user_id in rows:
+            if message.id in self.index or not message.content.strip():
+                continue
+            vector = get_embedding(message.content, model)
+            if vector is None:
+                # Ollama is down; the rest of the batch is retried by a backfill once the queue is idle
+                self._needs_backfill = True
+                break
+            ids.append((message.id, message.session_id, user_id))
+            vectors.append(vector)
+        self.index.add_many(ids, vectors)
+
+def init_embeddings(app):
+    """Create the embedding index for the Flask app and start the queue on first request"""
+    index = EmbeddingIndex(app.instance_path)
+    embedding_queue = EmbeddingQueue(app, index)
+
+    # Starting lazily keeps the debug reloader's parent process from writing to the index
+    @app.before_request
+    def start_embedding_queue():
+        embedding_queue.start()
+
+    return index, embedding_queue
@@ -6,6 +6,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import hashlib
 import enum
 
 db = SQLAlchemy()
@@ -135,6 +136,44 @@ class ChatSession(db.Model):
         """Get the last message in this session"""
         return self.messages[-1] if self.messages else None
     
+    def get_cache_validators(self):
+        """Get an (etag, last_modified) pair describing this session's messages"""
+        message_count, last_message_at = db.session.query(
+            db.func.count(Message.id),
+            db.func.max(Message.created_at)
+        ).filter(Message.session_id == self.id).one()
+        
+        # Adding a message does not touch updated_at, so the count covers new turns
+        last_modified = max(self.updated_at, last_message_at or self.updated_at)
+        etag = make_etag(self.id, self.updated_at.isoformat(), message_count)
+        return etag, last_modified
+    
+    @staticmethod
+    def get_user_cache_validators(user_id):
+        """Get an (etag, last_modified) pair describing all of a user's sessions"""
+        session_count, last_updated = db.session.query(
+            db.func.count(ChatSession.id),
+            db.func.max(ChatSession.updated_at)
+        ).filter(ChatSession.user_id == user_id).one()
+        message_count, last_message_at = db.session.query(
+            db.func.count(Message.id),
+            db.func.max(Message.created_at)
+        ).join(ChatSession, Message.session_id == ChatSession.id).filter(
+            ChatSession.user_id == user_id
+        ).one()
+        
+        # formatted_date says "Today"/"Yesterday", so the listing also changes at midnight
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        last_modified = max(d for d in (last_updated, last_message_at, today) if d)
+        etag = make_etag(
+            user_id,
+            session_count,
+            last_updated.isoformat() if last_updated else '',
+            message_count,
+            today.date().isoformat()
+        )
+        return etag, last_modified
+    
     def generate_title_from_content(self):
         """Generate a title based on the conversation content"""
         if not self.messages:
@@ -261,6 +300,44 @@ class SystemSettings(db.Model):
         self.value = value
         self.description = description
 
+def make_etag(*parts):
+    """Build a compact ETag value from the given version parts"""
+    return hashlib.sha1(":".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+
+def save_chat_turn(user_id, session_id, model, prompt, asked_at, reply=None, response_time=None):
+    """Add a chat turn (user message and optional reply) to the current transaction without committing"""
+    if session_id:
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).one()
+    else:
+        chat_session = ChatSession(user_id=user_id, model_used=model)
+        db.session.add(chat_session)
+        db.session.flush()
+    
+    user_message = Message(session_id=chat_session.id, content=prompt, role='user')
+    user_message.created_at = asked_at
+    chat_session.messages.append(user_message)
+    
+    # Update session title if this is the first message or title is still default
+    if not chat_session.title or chat_session.title == "New Chat":
+        chat_session.update_title()
+    
+    ai_message = None
+    if reply is not None:
+        ai_message = Message(
+            session_id=chat_session.id,
+            content=reply,
+            role='assistant',
+            response_time=response_time
+        )
+        chat_session.messages.append(ai_message)
+    
+    db.session.flush()
+    return {
+        'session_id': chat_session.id,
+        'user_message_id': user_message.id,
+        'assistant_message_id': ai_message.id if ai_message else None
+    }
+
 # Database initialization function
 def init_db(app):
     """Initialize the database with the Flask app"""
@@ -290,6 +367,7 @@ def init_db(app):
             ('session_timeout_hours', '24', 'Session timeout in hours'),
             ('enable_user_registration', 'true', 'Allow new user registration'),
             ('max_sessions_per_user', '50', 'Maximum chat sessions per user'),
+            ('embedding_model', 'nomic-embed-text', 'Ollama model used for semantic search embeddings'),
         ]
         
         for key, value, description in default_settings:
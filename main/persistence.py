@@ -0,0 +1,120 @@
+"""
+chatbot/main/persistence.py
+
+Write-behind persistence with group commit.
+
+Request threads hand units of work to a single background writer instead of
+committing themselves. The writer collects whatever arrives within a short
+window and applies it in one transaction, so concurrent chat turns share a
+single SQLite commit (and fsync) instead of paying for one each.
+
+Durability: `GroupCommitWriter.write` only returns once the transaction that
+contains the work has committed. A request that acknowledges a reply after
+`write` returns therefore never acknowledges data that is not on disk. Work
+that is queued but not yet committed when the process dies is lost, but no
+caller has been told it succeeded. If `write` times out, the work is
+cancelled before it starts, so a timeout always means nothing was saved.
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import queue
+import threading
+import time
+
+from models import db
+
+class GroupCommitWriter:
+    """Background writer that commits queued units of work in shared transactions"""
+
+    def __init__(self, app, window=0.005, max_batch=64):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the writer thread if it is not already running"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, work, *args, **kwargs):
+        """Queue `work(*args, **kwargs)` to run in the writer's transaction.
+
+        Returns a Future that resolves to the work's return value after commit.
+        Return plain values (ids, not model instances): the writer's session
+        is closed once the batch is done.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((future, work, args, kwargs))
+        return future
+
+    def write(self, work, *args, timeout=30, **kwargs):
+        """Run work in the writer's transaction and wait until it is committed.
+
+        Raises TimeoutError if the writer did not pick up the work in time; the
+        work is then cancelled and will not be saved.
+        """
+        future = self.submit(work, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise TimeoutError(f"Database writer did not respond within {timeout}s; nothing was saved")
+            # The writer already started on it, so its outcome is moments away
+            return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Skip work whose caller gave up waiting, and stop it from being cancelled later
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                with self.app.app_context():
+                    try:
+                        self._commit_batch(batch)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                # Keep the writer alive; fail whatever this batch left unanswered
+                print(f"Error in database writer: {e}")
+                for future, _, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit_batch(self, batch):
+        """Apply a batch in one transaction, falling back to one transaction per item"""
+        try:
+            results = [work(*args, **kwargs) for _, work, args, kwargs in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][0].set_exception(e)
+            else:
+                # Isolate the failing work so the rest of the batch still commits
+                for item in batch:
+                    self._commit_batch([item])
+            return
+
+        self.commits += 1
+        for (future, _, _, _), result in zip(batch, results):
+            future.set_result(result)